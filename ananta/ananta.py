@@ -8,23 +8,26 @@ automate repetitive tasks, and save time and effort.
 from . import __version__
 
 from .config import get_hosts
-from .output import print_output
-from .ssh import execute
-from types import ModuleType
-from typing import Dict
+from .output import (
+    OUTPUT_QUEUE_SIZE,
+    OutputQueue,
+    cache_end_markers,
+    cache_prompts,
+    print_output,
+)
+from .ssh import close_connections, execute
 import argparse
 import asyncio
 import os
 import sys
 
-uvloop: ModuleType | None = None
-try:
-    if sys.platform == "win32":
-        import winloop as uvloop
-    else:
-        import uvloop
-except ImportError:
-    pass
+if sys.platform == "win32":
+    import winloop as uvloop
+else:
+    import uvloop
+
+# Enough concurrent handshakes to keep every CPU busy, capped at 256
+DEFAULT_MAX_CONCURRENCY = min(256, (os.cpu_count() or 1) * 32)
 
 
 async def main(
@@ -37,57 +40,77 @@ async def main(
     default_key: str | None,
     color: bool,
     host_tags: str | None,
+    max_concurrency: int,
 ) -> None:
     """Main function to execute commands on multiple remote hosts."""
 
     hosts_to_execute, max_name_length = get_hosts(host_file, host_tags)
+    # Remote terminal width, leaving room for the prompt ("[name] ")
+    remote_width = local_display_width - max_name_length - 3
+    host_names = [host.name for host in hosts_to_execute]
+    cache_prompts(host_names, max_name_length, color)
+    cache_end_markers(host_names, remote_width, color)
 
-    # Dictionary to hold separate output queues for each host
-    output_queues: Dict[str, asyncio.Queue[str | None]] = {
-        host_name: asyncio.Queue() for host_name, *_ in hosts_to_execute
-    }
-
-    # Create a lock for synchronizing output printing
-    print_lock = asyncio.Lock()
+    # Single queue of (host_name, output) items shared by every host
+    output_queue = OutputQueue(OUTPUT_QUEUE_SIZE)
 
-    print_tasks = [
+    # One printer task formats and writes the output of all hosts
+    printer_task = asyncio.create_task(
         print_output(
-            host_name,
             max_name_length,
             allow_empty_line,
             allow_cursor_control,
-            separate_output,
-            print_lock,
-            output_queues[host_name],
+            output_queue,
             color,
         )
-        for host_name, *_ in hosts_to_execute
-    ]
-    asyncio.ensure_future(asyncio.gather(*print_tasks))
+    )
+
+    # Limit how many hosts are doing the SSH handshake at the same time
+    semaphore = asyncio.Semaphore(max_concurrency)
 
     tasks = [
-        execute(
-            host_name,
-            ip_address,
-            ssh_port,
-            username,
-            key_path,
-            ssh_command,
-            max_name_length,
-            local_display_width,
-            separate_output,
-            default_key,
-            output_queues[host_name],
-            color,
+        asyncio.create_task(
+            execute(
+                host,
+                ssh_command,
+                remote_width,
+                separate_output,
+                default_key,
+                output_queue,
+                color,
+                semaphore,
+            )
         )
-        for host_name, ip_address, ssh_port, username, key_path in hosts_to_execute
+        for host in hosts_to_execute
     ]
 
-    await asyncio.gather(*tasks)
-
-    # Put None in each host's output queue to signal the end of printing
-    for host_name in output_queues:
-        await output_queues[host_name].put(None)
+    hosts_done = asyncio.gather(*tasks)
+    try:
+        # Watch the printer as well: if it dies (e.g. BrokenPipeError when
+        # piped to head), nothing drains the bounded queue and the hosts
+        # would wait in put() forever
+        done, _ = await asyncio.wait(
+            {printer_task, hosts_done}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if printer_task in done:
+            printer_task.result()  # re-raise the printer's error
+            raise RuntimeError("Output printer stopped before the hosts")
+        await hosts_done
+    except BaseException:
+        # Cancel stragglers and the printer like asyncio.TaskGroup would
+        # (not used as it needs Python 3.11+)
+        for task in tasks:
+            task.cancel()
+        printer_task.cancel()
+        # Wait for them to unwind, which also retrieves their errors
+        await asyncio.gather(hosts_done, printer_task, return_exceptions=True)
+        raise
+    finally:
+        await close_connections()
+
+    # Put None in the output queue to signal the end of printing
+    await output_queue.put(None)
+    await printer_task
 
 
 def run_cli() -> None:
@@ -165,13 +188,23 @@ def run_cli() -> None:
         type=str,
         help="Path to default SSH private key",
     )
+    parser.add_argument(
+        "-m",
+        "-M",
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help=(
+            "Maximum number of SSH handshakes in progress at once; each "
+            "connection is closed when its host finishes "
+            f"(default: {DEFAULT_MAX_CONCURRENCY})"
+        ),
+    )
     args: argparse.Namespace = parser.parse_args()
-    if uvloop:
-        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     if args.version:
         print(
             f"Ananta-{__version__} "
-            f"powered by {asyncio.get_event_loop_policy().__module__}"
+            f"powered by {uvloop.__name__}-{uvloop.__version__}"
         )
         sys.exit(0)
     host_file: str | None = args.host_file
@@ -179,6 +212,8 @@ def run_cli() -> None:
     if (host_file is None) or (not ssh_command.strip()):
         parser.print_help()
         sys.exit(0)
+    if args.max_concurrency < 1:
+        parser.error("argument -m/-M/--max-concurrency: must be at least 1")
     try:
         local_display_width: int = args.terminal_width or int(
             os.environ.get("COLUMNS", os.get_terminal_size().columns)
@@ -186,7 +221,9 @@ def run_cli() -> None:
     except OSError:
         local_display_width = args.terminal_width or 80  # type: ignore
     color = not args.no_color
-    asyncio.run(
+    # uvloop is not always a win for CPU-heavy code, but Ananta only pumps SSH
+    # streams and hands lines between queues, which is pure I/O.
+    uvloop.run(
         main(
             host_file,
             ssh_command,
@@ -197,6 +234,7 @@ def run_cli() -> None:
             args.default_key,
             color,
             args.host_tags,
+            args.max_concurrency,
         )
     )
 
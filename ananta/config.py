@@ -1,46 +1,62 @@
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple
 import csv
 
 
-def get_hosts(host_file: str, host_tags: str | None) -> Tuple[List, int]:
+class Host(NamedTuple):
+    """A host from the hosts file."""
+
+    name: str
+    ip_address: str
+    ssh_port: int
+    username: str
+    key_path: str
+
+
+def get_hosts(host_file: str, host_tags: str | None) -> Tuple[List[Host], int]:
     """Read the hosts file and return a list of hosts to execute commands on."""
-    hosts_to_execute: List[Tuple[str, str, int, str, str]] = []
-    execute_tags = host_tags.split(",") if host_tags else []
-
-    with open(host_file, "r", encoding="utf-8") as hosts:
-        for row_line, row in enumerate(
-            csv.reader(hosts), start=1
-        ):  # Row line starts at 1 for human readability
-            if row and not row[0].startswith("#"):
-                # Process the row only if it is not empty and not a comment
-                try:
-                    host_name, ip_address, str_port, username = row[:4]
-                    ssh_port = int(str_port)
-                    key_path = row[4] if len(row) > 4 else ""
-                    tags = row[5] if len(row) > 5 else ""
-                except IndexError:
-                    print(
-                        f"Hosts file: {host_file} row {row_line} is incomplete. Skipping!"
-                    )
-                except ValueError:
-                    print(
-                        f"Hosts file: {host_file} parse error at row {row_line}. Skipping!"
-                    )
-                else:
-                    if host_tags is None or set(tags.split(":")).intersection(
-                        set(execute_tags)
-                    ):
-                        hosts_to_execute.append(
-                            (
-                                host_name,
-                                ip_address,
-                                ssh_port,
-                                username,
-                                key_path,
-                            )
-                        )
-
-    if hosts_to_execute:
-        max_name_length = max(len(name) for name, *_ in hosts_to_execute)
-        return (hosts_to_execute, max_name_length)
-    return ([], 0)
+    hosts_to_execute: List[Host] = []
+    execute_tag_set = frozenset(host_tags.split(",") if host_tags else [])
+    filter_tags = host_tags is not None
+    max_name_length = 0
+    append = hosts_to_execute.append  # skip the attribute lookup per row
+
+    # Read and decode the whole file at once; works for pipes and FIFOs too
+    with open(host_file, "rb") as hosts:
+        lines = hosts.read().decode("utf-8").splitlines()
+
+    for row_line, line in enumerate(
+        lines, start=1
+    ):  # Row line starts at 1 for human readability
+        if not line or line.startswith("#"):
+            # Skip empty and comment lines before doing any parsing
+            continue
+        if '"' in line:
+            # Quoted fields (e.g. a key path containing a comma) need csv
+            row = next(csv.reader((line,)))
+            if row[0].startswith("#"):
+                continue  # a quoted "#..." first field is a comment too
+        else:
+            row = line.split(",")
+        fields = len(row)
+        if fields < 4:
+            print(
+                f"Hosts file: {host_file} row {row_line} is incomplete. Skipping!"
+            )
+            continue
+        host_name, ip_address, str_port, username = row[:4]
+        try:
+            ssh_port = int(str_port)
+        except ValueError:
+            print(
+                f"Hosts file: {host_file} parse error at row {row_line}. Skipping!"
+            )
+            continue
+        key_path = row[4] if fields > 4 else ""
+        if not filter_tags or (
+            fields > 5 and not execute_tag_set.isdisjoint(row[5].split(":"))
+        ):
+            append(Host(host_name, ip_address, ssh_port, username, key_path))
+            if len(host_name) > max_name_length:
+                max_name_length = len(host_name)
+
+    return (hosts_to_execute, max_name_length)
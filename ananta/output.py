@@ -1,14 +1,22 @@
 from . import RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, RESET
-from itertools import cycle
-from random import shuffle
-from typing import Dict
+from functools import lru_cache, partial
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Tuple
 import asyncio
 import re
+import sys
 
-COLORS = [RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN]
-shuffle(COLORS)
-COLORS_CYCLE = cycle(COLORS)
+COLORS = (RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN)
 HOST_COLOR: Dict[str, str] = {}
+PROMPT_CACHE: Dict[str, str] = {}
+END_MARKER_CACHE: Dict[str, str] = {}
+
+# Maximum number of output items waiting to be printed; an item is at most
+# one read chunk (64 KiB), so queued output stays within about 16 MiB
+OUTPUT_QUEUE_SIZE = 256
+
+# Formatted output size (in characters) that triggers a write to stdout
+WRITE_BUFFER_SIZE = 65536
 
 # Pattern to match common cursor control and screen clear ANSI codes
 ansi_cursor_control = re.compile(
@@ -22,41 +30,111 @@ ansi_cursor_control = re.compile(
 # Pattern to match cursor movement to a specific column (\x1b[nG)
 ansi_cursor_move_to_column = re.compile(r"\x1b\[(\d+)?G")
 
+# Sequences that need the prompt re-inserted: erase line and carriage return
+_prompt_rewrite = r"\x1b\[[12]K|\r"
 
-def adjust_cursor_with_prompt(
-    line: str, prompt: str, allow_cursor_control: bool, max_name_length: int
-) -> str:
-    """Adjust the cursor control codes to display correctly with Ananta prompt."""
-    if not allow_cursor_control:
-        line = ansi_cursor_control.sub("", line)
-    else:
-        # Adjust \x1b[nG to account for prompt length
-        def adjust_cursor_movement(match):
-            n = (
-                int(match.group(1)) if match.group(1) else 1
-            )  # Default to 1 if no number
-            n += max_name_length + 3  # Add prompt length ("[max_name_length] ")
-            return f"\x1b[{n}G"
+# Single-pass rewrite patterns, with and without cursor control allowed
+ansi_rewrite_strip = re.compile(
+    f"{_prompt_rewrite}|{ansi_cursor_control.pattern}"
+)
+ansi_rewrite_keep = re.compile(
+    f"{_prompt_rewrite}|{ansi_cursor_move_to_column.pattern}"
+)
 
-        line = ansi_cursor_move_to_column.sub(adjust_cursor_movement, line)
 
-    # If erase to the beginning of line, jump to col 0, add prompt, then return
-    line = line.replace("\x1b[1K", f"\x1b[1K\x1b[s\x1b[G{prompt}\x1b[u")
+@lru_cache(maxsize=None)
+def _get_rewriter(
+    prompt: str, allow_cursor_control: bool, max_name_length: int
+) -> Callable[[str], str]:
+    """Build the single-pass rewrite function for a host's prompt."""
+    # Prompt length ("[max_name_length] ") added to column movements
+    column_offset = max_name_length + 3
+    erase_suffix = f"\x1b[s\x1b[G{prompt}\x1b[u"
+    carriage_return = f"\r{prompt}"
+
+    def rewrite(match: re.Match) -> str:
+        sequence = match.group(0)
+        if sequence == "\r":
+            # Add prompt to any carriage return
+            return carriage_return
+        if sequence[-1] == "K":
+            # If erase to the beginning of line or the whole line, jump to
+            # col 0, add prompt, then return
+            return sequence + erase_suffix
+        if not allow_cursor_control:
+            return ""
+        # Adjust \x1b[nG to account for prompt length
+        n = int(match.group(1)) if match.group(1) else 1  # Default to 1
+        return f"\x1b[{n + column_offset}G"
 
-    # If erase the whole line, jump to col 0, add prompt, then return
-    line = line.replace("\x1b[2K", f"\x1b[2K\x1b[s\x1b[G{prompt}\x1b[u")
+    pattern = ansi_rewrite_keep if allow_cursor_control else ansi_rewrite_strip
+    return partial(pattern.sub, rewrite)
 
-    # Add prompt to any carriage return
-    line = line.replace("\r", f"\r{prompt}")
 
-    return line.rstrip()
+def adjust_cursor_with_prompt(
+    line: str, prompt: str, allow_cursor_control: bool, max_name_length: int
+) -> str:
+    """Adjust the cursor control codes to display correctly with Ananta prompt."""
+    if "\x1b" not in line and "\r" not in line:
+        return line.rstrip()  # plain text, nothing for the regex to rewrite
+    rewrite = _get_rewriter(prompt, allow_cursor_control, max_name_length)
+    return rewrite(line).rstrip()
+
+
+class OutputQueue:
+    """Multi-producer, single-consumer queue of (host_name, output) items.
+
+    Lighter than asyncio.Queue: put() and get_all() only wait on an event
+    when the queue is full or empty, otherwise they are plain deque operations.
+    A maxsize of 0 means the queue is unbounded.
+    """
+
+    def __init__(self, maxsize: int = 0) -> None:
+        self._maxsize = maxsize
+        self._items: Deque[Tuple[str, str] | None] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def full(self) -> bool:
+        """Return True if there are maxsize items in the queue."""
+        return 0 < self._maxsize <= len(self._items)
+
+    async def put(self, item: Tuple[str, str] | None) -> None:
+        """Add an item, or None to signal the end of output.
+
+        Waits for the consumer to make room if the queue is full, so a slow
+        terminal applies back-pressure to the remote hosts.
+        """
+        while self.full():
+            self._space.clear()
+            await self._space.wait()
+        self._items.append(item)
+        self._ready.set()
+
+    async def get_all(self) -> List[Tuple[str, str] | None]:
+        """Remove and return every queued item, waiting for at least one."""
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        items = list(self._items)
+        self._items.clear()
+        self._space.set()
+        return items
 
 
 def _get_host_color(host_name: str) -> str:
     """Get the color associated with the host name."""
-    if HOST_COLOR.get(host_name) is None:
-        HOST_COLOR[host_name] = next(COLORS_CYCLE)
-    return HOST_COLOR[host_name]
+    host_color = HOST_COLOR.get(host_name)
+    if host_color is None:
+        # Colors are handed out in order of first use, so the same hosts file
+        # always gets the same colors and neighbouring hosts never share one
+        host_color = HOST_COLOR[host_name] = COLORS[
+            len(HOST_COLOR) % len(COLORS)
+        ]
+    return host_color
 
 
 def get_prompt(host_name: str, max_name_length: int, color: bool) -> str:
@@ -66,6 +144,14 @@ def get_prompt(host_name: str, max_name_length: int, color: bool) -> str:
     return f"[{host_name.rjust(max_name_length)}] "
 
 
+def cache_prompts(
+    host_names: Iterable[str], max_name_length: int, color: bool
+) -> None:
+    """Build the prompt of every host once so printing never reformats it."""
+    for host_name in host_names:
+        PROMPT_CACHE[host_name] = get_prompt(host_name, max_name_length, color)
+
+
 def get_end_marker(host_name: str, remote_width: int, color: bool) -> str:
     """Generate an ending line with color matched the host's color."""
     ending_line = "-" * remote_width
@@ -74,38 +160,73 @@ def get_end_marker(host_name: str, remote_width: int, color: bool) -> str:
     return ending_line
 
 
+def cache_end_markers(
+    host_names: Iterable[str], remote_width: int, color: bool
+) -> None:
+    """Build the end marker of every host once per run."""
+    for host_name in host_names:
+        END_MARKER_CACHE[host_name] = get_end_marker(
+            host_name, remote_width, color
+        )
+
+
 async def print_output(
-    host_name: str,
     max_name_length: int,
     allow_empty_line: bool,
     allow_cursor_control: bool,
-    separate_output: bool,
-    print_lock: asyncio.Lock,
-    output_queue: asyncio.Queue,
+    output_queue: OutputQueue,
     color: bool,
 ):
-    """Print the output from the remote host with the appropriate prompt."""
-    prompt = get_prompt(host_name, max_name_length, color)
-
-    while True:
-        output = await output_queue.get()
-        if output is None:
-            break
-        if separate_output:
-            # Synchronize printing of the entire output
-            async with print_lock:
-                for line in output.splitlines():
-                    adjusted_line = adjust_cursor_with_prompt(
-                        line, prompt, allow_cursor_control, max_name_length
+    """Print the output from every remote host with the appropriate prompt."""
+    # Write encoded output straight to the binary buffer, after flushing
+    # anything already printed through the text layer
+    sys.stdout.flush()
+    stdout = sys.stdout.buffer
+    keep_blank_lines = allow_empty_line or allow_cursor_control
+    line_end = f"{RESET}\n"
+    finished = False
+    while not finished:
+        # Format everything queued since the last wakeup and write it with a
+        # single write and flush, instead of one print() per line
+        buffer = []
+        buffered = 0  # characters in buffer
+        for item in await output_queue.get_all():
+            if item is None:
+                finished = True
+                break
+            host_name, output = item
+            prompt = PROMPT_CACHE.get(host_name) or get_prompt(
+                host_name, max_name_length, color
+            )
+            lines = output.splitlines()
+            if not keep_blank_lines:
+                # isspace() tests for blank lines without a stripped copy
+                lines = [line for line in lines if line and not line.isspace()]
+            if lines:
+                # Every line is prompt + line + RESET\n, so the whole chunk
+                # is one join over the host's fixed parts
+                formatted = (
+                    prompt
+                    + (line_end + prompt).join(
+                        [
+                            adjust_cursor_with_prompt(
+                                line,
+                                prompt,
+                                allow_cursor_control,
+                                max_name_length,
+                            )
+                            for line in lines
+                        ]
                     )
-                    if allow_empty_line or allow_cursor_control or line.strip():
-                        print(f"{prompt}{adjusted_line}{RESET}")
-        else:
-            for line in output.splitlines():
-                adjusted_line = adjust_cursor_with_prompt(
-                    line, prompt, allow_cursor_control, max_name_length
+                    + line_end
                 )
-                if allow_empty_line or allow_cursor_control or line.strip():
-                    # Synchronize printing of a single line
-                    async with print_lock:
-                        print(f"{prompt}{adjusted_line}{RESET}")
+                buffer.append(formatted)
+                buffered += len(formatted)
+            if buffered >= WRITE_BUFFER_SIZE:
+                # Keep the buffer bounded when a lot of output is queued
+                stdout.write("".join(buffer).encode("utf-8", "replace"))
+                buffer.clear()
+                buffered = 0
+        if buffer:
+            stdout.write("".join(buffer).encode("utf-8", "replace"))
+        stdout.flush()
@@ -1,45 +1,104 @@
 from . import LINES
-from ananta.output import get_end_marker
+from ananta.config import Host
+from ananta.output import END_MARKER_CACHE, OutputQueue, get_end_marker
+from functools import lru_cache, partial
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple, cast
 import asyncio
 import asyncssh
+import codecs
 import os
+import random
+
+# Pool key: (ip_address, ssh_port, username, private key paths)
+PoolKey = Tuple[str, int, str, Tuple[str, ...]]
+
+# Live connections by pool key, so that every session to the same host with
+# the same credentials is multiplexed over a single SSH connection
+CONN_POOL: Dict[PoolKey, asyncssh.SSHClientConnection] = {}
+CONN_LOCKS: Dict[PoolKey, asyncio.Lock] = {}
+
+# Parsed key pairs keyed by private key path, so every key is read only once
+KEYPAIR_CACHE: Dict[str, Sequence[asyncssh.SSHKeyPair]] = {}
+
+# Maximum size of a single read from the remote stdout stream
+READ_CHUNK_SIZE = 65536
+
+# Algorithms tried on the first connection attempt: the lowest latency AEAD
+# ciphers and Curve25519 key exchange
+PREFERRED_ALGORITHMS: Dict[str, List[str]] = {
+    "kex_algs": ["curve25519-sha256", "curve25519-sha256@libssh.org"],
+    "server_host_key_algs": ["ssh-ed25519", "rsa-sha2-256"],
+    # AES-GCM runs on AES-NI/ARMv8 crypto instructions, chacha20-poly1305
+    # is the fallback for CPUs without them; all are AEAD, so the MAC list
+    # is left to asyncssh as it is never used
+    "encryption_algs": [
+        "aes128-gcm@openssh.com",
+        "aes256-gcm@openssh.com",
+        "chacha20-poly1305@openssh.com",
+    ],
+}
+
+# Seconds between keepalives, and unanswered keepalives before disconnecting
+KEEPALIVE_INTERVAL = 30
+KEEPALIVE_COUNT_MAX = 3
+
+
+class PooledSSHClient(asyncssh.SSHClient):
+    """SSH client that removes its connection from the pool once it is lost."""
+
+    def __init__(self, pool_key: PoolKey):
+        self.pool_key = pool_key
+        self.users = 0  # hosts currently running a command on the connection
+        self._conn: asyncssh.SSHClientConnection | None = None
+
+    def connection_made(self, conn: asyncssh.SSHClientConnection) -> None:
+        self._conn = conn
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if CONN_POOL.get(self.pool_key) is self._conn:
+            del CONN_POOL[self.pool_key]
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff (0.1s, 0.4s, 1.6s, ...) with up to 0.1s of jitter.
+
+    The jitter keeps hosts that failed together from retrying in lockstep.
+    """
+    return 0.1 * 4**attempt + random.random() * 0.1
 
 
 async def retry_connect(
     ip_address: str,
     ssh_port: int,
     username: str,
-    client_keys: list[str],
+    client_keys: Sequence[asyncssh.SSHKeyPair],
     timeout: float,
     max_retries: int,
+    client_factory: Callable[[], asyncssh.SSHClient] | None = None,
 ) -> asyncssh.SSHClientConnection:
     """Attempt to establish an SSH connection with retries."""
     last_error: asyncssh.Error | asyncio.TimeoutError | None = None
-    algorithm_options = {
-        "encryption_algs": [
-            "chacha20-poly1305@openssh.com",
-            "aes128-ctr",
-            "aes256-ctr",
-        ],
-        "mac_algs": ["hmac-sha2-256", "hmac-sha1"],
-    }  # try with the lowest latency algorithm first
+    algorithm_options: Dict[str, List[str]] = PREFERRED_ALGORITHMS
     for attempt in range(max_retries + 1):
         try:
-            return await asyncio.wait_for(
-                asyncssh.connect(
-                    host=ip_address,
-                    port=ssh_port,
-                    username=username,
-                    client_keys=client_keys,
-                    known_hosts=None,
-                    compression_algs=None,
-                    **algorithm_options,
-                ),
-                timeout=timeout,
+            # connect_timeout covers TCP connect, key exchange and auth
+            return await asyncssh.connect(
+                host=ip_address,
+                port=ssh_port,
+                username=username,
+                client_keys=client_keys,
+                known_hosts=None,
+                compression_algs=None,
+                keepalive_interval=KEEPALIVE_INTERVAL,
+                keepalive_count_max=KEEPALIVE_COUNT_MAX,
+                client_factory=client_factory,
+                connect_timeout=timeout,
+                **algorithm_options,
             )
         except asyncssh.Error as error:
             last_error = error
-            _sleep = 1
+            _sleep = retry_delay(attempt)
             if (
                 getattr(error, "code", None)
                 == asyncssh.DISC_KEY_EXCHANGE_FAILED
@@ -51,12 +110,16 @@ async def retry_connect(
         except asyncio.TimeoutError as error:
             last_error = error
             if attempt < max_retries:
-                await asyncio.sleep(1)
+                await asyncio.sleep(retry_delay(attempt))
+        except (OSError, ValueError) as error:
+            # Refused/unreachable hosts won't get better by retrying;
+            # execute() adds the "Error connecting to <host>" context
+            raise ConnectionError(str(error)) from error
     if isinstance(last_error, asyncio.TimeoutError):
         raise ConnectionError(
             f"Connection to {ip_address} timed out after {timeout}s"
         )
-    raise ConnectionError(f"Error connecting to {ip_address}: {last_error}")
+    raise ConnectionError(str(last_error))
 
 
 def get_ssh_keys(key_path: str | None, default_key: str | None) -> list[str]:
@@ -82,6 +145,34 @@ def get_ssh_keys(key_path: str | None, default_key: str | None) -> list[str]:
     return available_keys
 
 
+@lru_cache(maxsize=None)
+def resolve_ssh_keys(
+    key_path: str | None, default_key: str | None
+) -> Tuple[str, ...]:
+    """Cached get_ssh_keys, so ~/.ssh is only checked once per key setting."""
+    return tuple(get_ssh_keys(key_path, default_key))
+
+
+def load_client_keys(key_paths: Sequence[str]) -> list[asyncssh.SSHKeyPair]:
+    """Load the key pairs for the given key paths, parsing each file once."""
+    client_keys: list[asyncssh.SSHKeyPair] = []
+    for path in key_paths:
+        if path not in KEYPAIR_CACHE:
+            try:
+                KEYPAIR_CACHE[path] = asyncssh.load_keypairs(path)
+            except (OSError, ValueError) as error:
+                raise ConnectionError(
+                    f"Cannot load SSH key {path}: {error}"
+                ) from error
+        client_keys.extend(KEYPAIR_CACHE[path])
+    return client_keys
+
+
+def get_pool_client(conn: asyncssh.SSHClientConnection) -> PooledSSHClient:
+    """Return the PooledSSHClient that tracks a pooled connection."""
+    return cast(PooledSSHClient, conn.get_owner())
+
+
 async def establish_ssh_connection(
     ip_address: str,
     ssh_port: int,
@@ -91,115 +182,166 @@ async def establish_ssh_connection(
     timeout: float = 5.0,
     max_retries: int = 2,
 ) -> asyncssh.SSHClientConnection:
-    """Establish an SSH connection to the remote host."""
-    try:
-        client_keys = get_ssh_keys(key_path, default_key)
-        return await retry_connect(
-            ip_address, ssh_port, username, client_keys, timeout, max_retries
-        )
-    except Exception as error:
-        raise ConnectionError(f"Error connecting to {ip_address}: {error}")
+    """Establish an SSH connection to the remote host, reusing a pooled one."""
+    # Key and connect errors already surface as ConnectionError
+    key_paths = resolve_ssh_keys(key_path, default_key)
+    pool_key = (ip_address, ssh_port, username, key_paths)
+    async with CONN_LOCKS.setdefault(pool_key, asyncio.Lock()):
+        # Lost connections remove themselves from the pool (PooledSSHClient)
+        conn = CONN_POOL.get(pool_key)
+        if conn is None:
+            conn = await retry_connect(
+                ip_address,
+                ssh_port,
+                username,
+                load_client_keys(key_paths),
+                timeout,
+                max_retries,
+                partial(PooledSSHClient, pool_key),
+            )
+            CONN_POOL[pool_key] = conn
+        get_pool_client(conn).users += 1
+        return conn
 
 
-async def execute_command(
-    conn: asyncssh.SSHClientConnection,
-    ssh_command: str,
-    remote_width: int,
-    color: bool,
-) -> str:
-    """Execute the given command on the remote host through the SSH connection."""
-    try:
-        result = await conn.run(
-            command=f"env COLUMNS={remote_width} LINES={LINES} {ssh_command}",
-            term_type="ansi" if color else "dumb",
-            term_size=(remote_width, LINES),
-            env={},
-        )
-        if isinstance(result.stdout, bytes):
-            return result.stdout.decode("utf-8")
-        elif isinstance(result.stdout, str):
-            return result.stdout
-        else:
-            return f"Host returns unprintable output, got {type(result.stdout).__name__}"
-    except UnicodeDecodeError as error:
-        return "Host returns bytes that cannot be decoded as UTF-8"
-    except asyncssh.Error as error:
-        return f"Error executing command: {error}"
-    finally:
+async def release_ssh_connection(conn: asyncssh.SSHClientConnection) -> None:
+    """Give back a pooled connection, closing it once no host is using it."""
+    client = get_pool_client(conn)
+    client.users -= 1
+    if client.users == 0:
+        # Keep only connections in use open, instead of every host's until
+        # the whole run is over
+        if CONN_POOL.get(client.pool_key) is conn:
+            del CONN_POOL[client.pool_key]
         conn.close()
+        await conn.wait_closed()
+
+
+async def close_connections() -> None:
+    """Close every pooled SSH connection and wait for them to shut down."""
+    conns = list(CONN_POOL.values())
+    CONN_POOL.clear()
+    for conn in conns:
+        conn.close()
+    await asyncio.gather(
+        *(conn.wait_closed() for conn in conns), return_exceptions=True
+    )
+
+
+@lru_cache(maxsize=None)
+def get_process_options(
+    ssh_command: str, remote_width: int, color: bool
+) -> Mapping[str, Any]:
+    """Build the create_process arguments once, as they are the same per run.
+
+    The cached mapping is shared by every host, so it is read-only.
+    """
+    return MappingProxyType(
+        {
+            # Set COLUMNS and LINES through `env`: SSH env requests are
+            # dropped by sshd unless it has AcceptEnv for them, and
+            # `VAR=value cmd` is not understood by every login shell
+            "command": f"env COLUMNS={remote_width} LINES={LINES} {ssh_command}",
+            "term_type": "ansi" if color else "dumb",
+            "term_size": (remote_width, LINES),
+            "encoding": None,
+        }
+    )
 
 
 async def stream_command_output(
     conn: asyncssh.SSHClientConnection,
+    host_name: str,
     ssh_command: str,
     remote_width: int,
-    output_queue: asyncio.Queue[str | None],
+    output_queue: OutputQueue,
     color: bool,
+    separate_output: bool = False,
 ) -> None:
-    """Stream the output of the command from the remote host to the output queue."""
+    """Stream the output of the command from the remote host to the output queue.
+
+    With separate_output, the whole output is collected and put into the
+    queue as a single item once the command finishes.
+    """
     try:
         async with conn.create_process(
-            command=f"env COLUMNS={remote_width} LINES={LINES} {ssh_command}",
-            term_type="ansi" if color else "dumb",
-            term_size=(remote_width, 1000),
-            env={},
+            **get_process_options(ssh_command, remote_width, color)
         ) as process:  # type: asyncssh.SSHClientProcess
-            async for line in process.stdout:  # type: bytes | str
-                # Put output into the host's output queue
-                if isinstance(line, bytes):
-                    try:
-                        await output_queue.put(line.decode("utf-8"))
-                    except UnicodeDecodeError as error:
-                        await output_queue.put(
-                            f"Host returns line with bytes that cannot be decoded: {error}"
-                        )
-                elif isinstance(line, str):
-                    await output_queue.put(line)
-                else:
-                    await output_queue.put(
-                        f"Host returns unprintable line: {repr(line)}"
-                    )
+            # Decode incrementally so multi-byte characters split across
+            # chunks survive, and undecodable bytes do not drop a chunk
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            pending = ""  # trailing partial line carried to the next chunk
+            collected: list[str] = []  # whole output, for separate_output
+            while True:
+                raw_chunk = await process.stdout.read(READ_CHUNK_SIZE)
+                if not raw_chunk:
+                    break
+                chunk = decoder.decode(raw_chunk)
+                if separate_output:
+                    collected.append(chunk)
+                    continue
+                # Only complete lines go into the output queue, so that
+                # every line gets exactly one prompt when it is printed
+                complete, newline, pending = (pending + chunk).rpartition("\n")
+                if newline:
+                    await output_queue.put((host_name, complete + newline))
+            remainder = decoder.decode(b"", final=True)
+            if separate_output:
+                pending = "".join(collected) + remainder
+            else:
+                pending += remainder
+            if pending:
+                await output_queue.put((host_name, pending))
     except asyncssh.Error as error:
-        await output_queue.put(f"Error executing command: {error}")
+        await output_queue.put((host_name, f"Error executing command: {error}"))
 
 
 async def execute(
-    host_name: str,
-    ip_address: str,
-    ssh_port: int,
-    username: str,
-    key_path: str | None,
+    host: Host,
     ssh_command: str,
-    max_name_length: int,
-    local_display_width: int,
+    remote_width: int,
     separate_output: bool,
     default_key: str | None,
-    output_queue: asyncio.Queue,
+    output_queue: OutputQueue,
     color: bool,
+    semaphore: asyncio.Semaphore,
 ) -> None:
     """Execute the SSH command on the remote host and handle the output."""
-    remote_width = local_display_width - max_name_length - 3
-
+    host_name = host.name
     try:
-        conn = await establish_ssh_connection(
-            ip_address, ssh_port, username, key_path, default_key
-        )
-        if separate_output:
-            output = await execute_command(
-                conn, ssh_command, remote_width, color
+        # Bound the number of hosts handshaking at the same time; commands
+        # run outside it so long-running ones don't hold back other hosts
+        async with semaphore:
+            conn = await establish_ssh_connection(
+                host.ip_address,
+                host.ssh_port,
+                host.username,
+                host.key_path,
+                default_key,
             )
-            # Put output into the host's output queue
-            await output_queue.put(output)
-        else:
+        try:
             await stream_command_output(
-                conn, ssh_command, remote_width, output_queue, color
+                conn,
+                host_name,
+                ssh_command,
+                remote_width,
+                output_queue,
+                color,
+                separate_output,
             )
+        finally:
+            await release_ssh_connection(conn)
     except ConnectionError as error:
-        await output_queue.put(f"Error connecting to {host_name}: {error}")
+        await output_queue.put(
+            (host_name, f"Error connecting to {host_name}: {error}")
+        )
     except RuntimeError as error:
         await output_queue.put(
-            f"Error executing command on {host_name}: {error}"
+            (host_name, f"Error executing command on {host_name}: {error}")
         )
     finally:
         # Signal end of output once, regardless of success or failure
-        await output_queue.put(get_end_marker(host_name, remote_width, color))
+        end_marker = END_MARKER_CACHE.get(host_name) or get_end_marker(
+            host_name, remote_width, color
+        )
+        await output_queue.put((host_name, end_marker))
@@ -0,0 +1,187 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from ananta.ananta import main
+from ananta.config import Host
+
+
+@pytest.mark.asyncio
+async def test_main_cancels_remaining_tasks_on_failure():
+    """Tests that a failing host cancels the other hosts and the printer."""
+    hosts = [
+        Host("fail", "10.0.0.1", 22, "user", "#"),
+        Host("slow", "10.0.0.2", 22, "user", "#"),
+    ]
+    cancelled = []
+
+    async def fake_execute(host, *args):
+        if host.name == "fail":
+            raise ValueError("boom")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(host.name)
+            raise
+
+    with (
+        patch("ananta.ananta.get_hosts", return_value=(hosts, 4)),
+        patch("ananta.ananta.execute", new=fake_execute),
+        patch("ananta.ananta.close_connections", new=AsyncMock()) as close,
+    ):
+        with pytest.raises(ValueError, match="boom"):
+            await main(
+                "hosts.csv",
+                "true",
+                80,
+                False,
+                False,
+                False,
+                None,
+                False,
+                None,
+                4,
+            )
+        await asyncio.sleep(0)
+
+    assert cancelled == ["slow"]
+    close.assert_awaited_once()
+    pending = [
+        task
+        for task in asyncio.all_tasks()
+        if task is not asyncio.current_task()
+    ]
+    assert pending == []
+
+
+@pytest.mark.asyncio
+async def test_main_ends_when_printer_fails():
+    """Tests that a dead printer stops the hosts instead of hanging main()."""
+    hosts = [Host("host", "10.0.0.1", 22, "user", "#")]
+
+    async def chatty_execute(
+        host,
+        ssh_command,
+        remote_width,
+        separate_output,
+        default_key,
+        output_queue,
+        *args,
+    ):
+        for number in range(6000):
+            await output_queue.put((host.name, f"line {number}\n"))
+
+    stdout = MagicMock()
+    stdout.buffer.write.side_effect = BrokenPipeError
+    with (
+        patch("ananta.ananta.get_hosts", return_value=(hosts, 4)),
+        patch("ananta.ananta.execute", new=chatty_execute),
+        patch("ananta.ananta.close_connections", new=AsyncMock()) as close,
+        patch("ananta.output.sys.stdout", stdout),
+    ):
+        with pytest.raises(BrokenPipeError):
+            await asyncio.wait_for(
+                main(
+                    "hosts.csv",
+                    "true",
+                    80,
+                    False,
+                    False,
+                    False,
+                    None,
+                    False,
+                    None,
+                    4,
+                ),
+                timeout=5,
+            )
+    close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_main_cancels_hosts_when_printer_fails():
+    """Tests that a printer failure cancels hosts that are still running."""
+    hosts = [Host("slow", "10.0.0.2", 22, "user", "#")]
+    cancelled = []
+
+    async def slow_execute(host, *args):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(host.name)
+            raise
+
+    with (
+        patch("ananta.ananta.get_hosts", return_value=(hosts, 4)),
+        patch("ananta.ananta.execute", new=slow_execute),
+        patch("ananta.ananta.close_connections", new=AsyncMock()),
+        patch(
+            "ananta.ananta.print_output",
+            new=AsyncMock(side_effect=OSError("printer failed")),
+        ),
+    ):
+        with pytest.raises(OSError, match="printer failed"):
+            await asyncio.wait_for(
+                main(
+                    "hosts.csv",
+                    "true",
+                    80,
+                    False,
+                    False,
+                    False,
+                    None,
+                    False,
+                    None,
+                    4,
+                ),
+                timeout=5,
+            )
+
+    assert cancelled == ["slow"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("host_count", [2, 0])
+async def test_main_finishes_normally(host_count, capsys):
+    """Tests that a successful run returns, with or without any hosts."""
+    hosts = [
+        Host(f"host-{number}", f"10.0.0.{number}", 22, "user", "#")
+        for number in range(1, host_count + 1)
+    ]
+
+    async def fake_execute(
+        host,
+        ssh_command,
+        remote_width,
+        separate_output,
+        default_key,
+        output_queue,
+        *args,
+    ):
+        await output_queue.put((host.name, f"output of {host.name}\n"))
+
+    with (
+        patch("ananta.ananta.get_hosts", return_value=(hosts, 6)),
+        patch("ananta.ananta.execute", new=fake_execute),
+        patch("ananta.ananta.close_connections", new=AsyncMock()) as close,
+    ):
+        await asyncio.wait_for(
+            main(
+                "hosts.csv",
+                "true",
+                80,
+                False,
+                False,
+                False,
+                None,
+                False,
+                None,
+                4,
+            ),
+            timeout=5,
+        )
+
+    close.assert_awaited_once()
+    output = capsys.readouterr().out
+    for host in hosts:
+        assert f"[{host.name}] output of {host.name}" in output
@@ -1,4 +1,7 @@
-from ananta.config import get_hosts
+import pytest
+import os
+import threading
+from ananta.config import Host, get_hosts
 
 # Sample CSV content for testing
 HOSTS_CSV_CONTENT = """# This is a comment line
@@ -27,6 +30,13 @@ def test_get_hosts_no_tags(tmp_path):
     assert hosts[1] == ("host-2", "10.0.0.2", 2202, "user2", "#")
     assert hosts[2] == ("host-3", "10.0.0.3", 22, "user3", "/specific/key3")
     assert hosts[3] == ("host-5", "10.0.0.5", 22, "user5", "#")
+    assert hosts[1] == Host(
+        name="host-2",
+        ip_address="10.0.0.2",
+        ssh_port=2202,
+        username="user2",
+        key_path="#",
+    )
 
 
 # Test tag filtering
@@ -76,3 +86,86 @@ def test_get_hosts_skips_malformed(tmp_path, capsys):
     assert (
         f"Hosts file: {str(p)} parse error at row 7" in captured.out
     )  # Row numbers start from 1
+
+
+# Test handling of incomplete lines (should be skipped)
+def test_get_hosts_skips_incomplete(tmp_path, capsys):
+    """Tests that lines with fewer than four fields are reported and skipped."""
+    p = tmp_path / "hosts.csv"
+    p.write_text(
+        "host-1,10.0.0.1,22,user1\n\nhost-2,10.0.0.2\n", encoding="utf-8"
+    )
+
+    hosts, max_len = get_hosts(str(p), None)
+    assert hosts == [("host-1", "10.0.0.1", 22, "user1", "")]
+    assert max_len == 6
+
+    captured = capsys.readouterr()
+    assert f"Hosts file: {str(p)} row 3 is incomplete" in captured.out
+
+
+def test_get_hosts_empty_file(tmp_path):
+    """Tests that an empty hosts file yields no hosts."""
+    p = tmp_path / "hosts.csv"
+    p.write_text("", encoding="utf-8")
+
+    assert get_hosts(str(p), None) == ([], 0)
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs os.mkfifo")
+def test_get_hosts_from_fifo(tmp_path):
+    """Tests that hosts can be read from a pipe, e.g. <(generate-hosts)."""
+    fifo = tmp_path / "hosts.fifo"
+    os.mkfifo(fifo)
+
+    def write_hosts():
+        with open(fifo, "w", encoding="utf-8") as f:
+            f.write("h1,10.0.0.1,22,u\n")
+
+    writer = threading.Thread(target=write_hosts)
+    writer.start()
+    try:
+        hosts = get_hosts(str(fifo), None)
+    finally:
+        writer.join()
+    assert hosts == ([("h1", "10.0.0.1", 22, "u", "")], 2)
+
+
+def test_get_hosts_quoted_fields(tmp_path):
+    """Tests that quoted fields may contain commas."""
+    p = tmp_path / "hosts.csv"
+    p.write_text(
+        'host-1,10.0.0.1,22,user1,"/keys/a,b",web\n'
+        'host-2,10.0.0.2,22,user2,#,"db:web"\n',
+        encoding="utf-8",
+    )
+
+    hosts, _ = get_hosts(str(p), "web")
+    assert hosts == [
+        ("host-1", "10.0.0.1", 22, "user1", "/keys/a,b"),
+        ("host-2", "10.0.0.2", 22, "user2", "#"),
+    ]
+
+
+def test_get_hosts_ignores_extra_columns(tmp_path):
+    """Tests that columns after the tags do not change tag matching."""
+    p = tmp_path / "hosts.csv"
+    p.write_text(
+        "h1,10.0.0.1,22,u,#,web,extra\n" 'h2,10.0.0.2,22,u,"#",web,extra\n',
+        encoding="utf-8",
+    )
+
+    hosts, _ = get_hosts(str(p), "web")
+    assert [host.name for host in hosts] == ["h1", "h2"]
+
+
+def test_get_hosts_skips_quoted_comment(tmp_path):
+    """Tests that a row whose unquoted first field starts with # is skipped."""
+    p = tmp_path / "hosts.csv"
+    p.write_text(
+        '"#host-1",10.0.0.1,22,user1,#,web\nhost-2,10.0.0.2,22,user2\n',
+        encoding="utf-8",
+    )
+
+    hosts, _ = get_hosts(str(p), None)
+    assert [host.name for host in hosts] == ["host-2"]
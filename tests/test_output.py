@@ -2,6 +2,13 @@ import pytest
 from ananta.output import (
     get_prompt,
     get_end_marker,
+    cache_prompts,
+    cache_end_markers,
+    print_output,
+    OutputQueue,
+    COLORS,
+    END_MARKER_CACHE,
+    PROMPT_CACHE,
     adjust_cursor_with_prompt,
     _get_host_color,  # Import for potential direct testing if needed
     RED,
@@ -12,6 +19,7 @@ from ananta.output import (
     CYAN,
     RESET,  # Import colors
 )
+import asyncio
 import re
 
 ALL_COLORS = [RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN]
@@ -20,9 +28,11 @@ ALL_COLORS = [RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN]
 # Clear color cache between tests if necessary, though unlikely needed here
 @pytest.fixture(autouse=True)
 def clear_host_color_cache():
-    from ananta.output import HOST_COLOR
+    from ananta.output import END_MARKER_CACHE, HOST_COLOR, PROMPT_CACHE
 
     HOST_COLOR.clear()
+    PROMPT_CACHE.clear()
+    END_MARKER_CACHE.clear()
 
 
 def test_get_prompt_no_color():
@@ -44,15 +54,36 @@ def test_get_prompt_with_color():
     prompt_again = get_prompt("host-1", 8, color=True)
     color_code_2 = prompt_again.split("[")[0]
     assert color_code_1 == color_code_2
-    # Ensure different hosts get different colors (usually)
+    # Ensure different hosts get different colors
     prompt2 = get_prompt("host-2", 8, color=True)
-    # This might fail if COLORS cycle wraps around quickly with few hosts
-    # but generally should hold true for different hosts.
     assert [prompt.startswith(color) for color in ALL_COLORS] != [
         prompt2.startswith(color) for color in ALL_COLORS
     ]
 
 
+def test_host_colors_are_assigned_in_order():
+    """Tests that hosts get the colors in order, wrapping after all are used."""
+    host_names = [f"host-{i}" for i in range(len(COLORS) + 1)]
+    colors = [_get_host_color(host_name) for host_name in host_names]
+    assert colors[:-1] == list(COLORS)
+    assert colors[-1] == COLORS[0]
+    assert _get_host_color("host-1") == COLORS[1]
+
+
+def test_cache_prompts():
+    """Tests that cached prompts match freshly generated ones."""
+    cache_prompts(["host-1", "host-22"], 7, color=True)
+    assert PROMPT_CACHE["host-1"] == get_prompt("host-1", 7, color=True)
+    assert PROMPT_CACHE["host-22"] == get_prompt("host-22", 7, color=True)
+
+
+def test_cache_end_markers():
+    """Tests that cached end markers match freshly generated ones."""
+    cache_end_markers(["host-1", "host-2"], 30, color=True)
+    assert END_MARKER_CACHE["host-1"] == get_end_marker("host-1", 30, True)
+    assert END_MARKER_CACHE["host-2"] == get_end_marker("host-2", 30, True)
+
+
 def test_get_end_marker_no_color():
     """Tests end marker generation without color."""
     marker = get_end_marker("myhost", 20, color=False)
@@ -148,3 +179,67 @@ def test_adjust_cursor_with_control(line_input, expected_output_with_control):
         max_name_length=len(prompt) - 3,
     )
     assert adjusted == expected_output_with_control.rstrip()
+
+
+@pytest.mark.asyncio
+async def test_print_output_writes_prefixed_lines(capsys):
+    """Tests that queued output is printed with the prompt on every line."""
+    queue = OutputQueue()
+    await queue.put(("host", "first\n\nsecond\n"))
+    await queue.put(("h2", "third\n"))
+    await queue.put(None)
+    await print_output(4, False, False, queue, color=False)
+    captured = capsys.readouterr()
+    assert captured.out == (
+        f"[host] first{RESET}\n[host] second{RESET}\n[  h2] third{RESET}\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_print_output_keeps_empty_lines(capsys):
+    """Tests that empty lines get a prompt when allow_empty_line is set."""
+    queue = OutputQueue()
+    await queue.put(("host", "first\n\nsecond"))
+    await queue.put(("host", ""))
+    await queue.put(None)
+    await print_output(4, True, False, queue, color=False)
+    captured = capsys.readouterr()
+    assert captured.out == (
+        f"[host] first{RESET}\n[host] {RESET}\n[host] second{RESET}\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_output_queue_wakes_up_consumer():
+    """Tests that a waiting consumer gets the items in order as they are put."""
+    queue = OutputQueue()
+    consumer = asyncio.create_task(queue.get_all())
+    await asyncio.sleep(0)
+    assert not consumer.done()
+    await queue.put(("host", "first"))
+    await queue.put(("host", "second"))
+    assert await consumer == [("host", "first"), ("host", "second")]
+    assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_output_queue_put_waits_when_full():
+    """Tests that put() blocks on a full queue until the consumer drains it."""
+    queue = OutputQueue(maxsize=1)
+    await queue.put(("host", "first"))
+    producer = asyncio.create_task(queue.put(("host", "second")))
+    await asyncio.sleep(0)
+    assert not producer.done()
+    assert await queue.get_all() == [("host", "first")]
+    await producer
+    assert await queue.get_all() == [("host", "second")]
+
+
+@pytest.mark.asyncio
+async def test_output_queue_get_all_drains_queue():
+    """Tests that get_all() returns every queued item in order."""
+    queue = OutputQueue()
+    await queue.put(("host", "first"))
+    await queue.put(None)
+    assert await queue.get_all() == [("host", "first"), None]
+    assert len(queue) == 0
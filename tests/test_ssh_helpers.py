@@ -1,9 +1,39 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
 import os  # For os.path.join
 
+from ananta import LINES
+from ananta.config import Host
+from ananta.output import OutputQueue, get_end_marker
+
 # Assuming ssh.py is importable
-from ananta.ssh import get_ssh_keys
+from ananta.ssh import (
+    CONN_POOL,
+    KEYPAIR_CACHE,
+    PooledSSHClient,
+    establish_ssh_connection,
+    execute,
+    get_process_options,
+    get_ssh_keys,
+    load_client_keys,
+    release_ssh_connection,
+    resolve_ssh_keys,
+    retry_delay,
+    stream_command_output,
+)
+
+
+def fake_connection(chunks):
+    """Build a connection whose process stdout yields the given chunks."""
+    process = MagicMock()
+    process.stdout.read = AsyncMock(side_effect=chunks)
+    conn = MagicMock()
+    conn.create_process.return_value.__aenter__ = AsyncMock(
+        return_value=process
+    )
+    conn.create_process.return_value.__aexit__ = AsyncMock(return_value=None)
+    return conn
 
 
 # Use patch to mock os.path.exists and os.path.expanduser
@@ -78,3 +108,201 @@ def test_get_ssh_keys(mock_expanduser, mock_exists):
     mock_exists.side_effect = exists_side_effect_ed25519  # Find ed25519 again
     assert get_ssh_keys(None, None) == expected_keys_ed25519
     assert get_ssh_keys("", None) == expected_keys_ed25519
+
+
+@pytest.mark.asyncio
+async def test_establish_ssh_connection_reuses_pooled_connection():
+    """Tests that a live pooled connection is returned instead of reconnecting."""
+    conn = MagicMock()
+    conn.get_owner.return_value = PooledSSHClient(("10.0.0.1",))
+    CONN_POOL.clear()
+    with (
+        patch("ananta.ssh.load_client_keys", return_value=[]),
+        patch(
+            "ananta.ssh.retry_connect", new=AsyncMock(return_value=conn)
+        ) as mock_connect,
+    ):
+        first = await establish_ssh_connection(
+            "10.0.0.1", 22, "user", "/key", None
+        )
+        second = await establish_ssh_connection(
+            "10.0.0.1", 22, "user", "/key", None
+        )
+        await establish_ssh_connection(
+            "10.0.0.1", 22, "user", "/other/key", None
+        )
+    assert first is second is conn
+    # A different key must not reuse the connection authenticated by /key
+    assert mock_connect.await_count == 2
+    assert conn.get_owner().users == 3
+    CONN_POOL.clear()
+
+
+@pytest.mark.asyncio
+async def test_release_ssh_connection_closes_after_last_user():
+    """Tests that a pooled connection is closed once its last host is done."""
+    pool_key = ("10.0.0.1", 22, "user", ("/key",))
+    client = PooledSSHClient(pool_key)
+    client.users = 2
+    conn = MagicMock()
+    conn.get_owner.return_value = client
+    conn.wait_closed = AsyncMock()
+    CONN_POOL[pool_key] = conn
+
+    await release_ssh_connection(conn)
+    assert CONN_POOL[pool_key] is conn
+    conn.close.assert_not_called()
+
+    await release_ssh_connection(conn)
+    assert pool_key not in CONN_POOL
+    conn.close.assert_called_once()
+    conn.wait_closed.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_stream_command_output_keeps_lines_whole():
+    """Tests that chunked reads only queue complete lines."""
+    conn = fake_connection([b"line 1\nli", b"ne 2\nline", b" 3", b""])
+
+    queue = OutputQueue()
+    await stream_command_output(conn, "host", "true", 80, queue, False)
+    assert await queue.get_all() == [
+        ("host", "line 1\n"),
+        ("host", "line 2\n"),
+        ("host", "line 3"),
+    ]
+
+
+@patch("ananta.ssh.asyncssh.load_keypairs", return_value=["keypair"])
+def test_load_client_keys_parses_each_key_once(mock_load_keypairs):
+    """Tests that key files are parsed once and then served from the cache."""
+    KEYPAIR_CACHE.clear()
+    assert load_client_keys(["/path/to/key"]) == ["keypair"]
+    assert load_client_keys(["/path/to/key"]) == ["keypair"]
+    mock_load_keypairs.assert_called_once_with("/path/to/key")
+    KEYPAIR_CACHE.clear()
+
+
+@patch(
+    "ananta.ssh.asyncssh.load_keypairs",
+    side_effect=FileNotFoundError("No such file"),
+)
+def test_load_client_keys_reports_unreadable_key(mock_load_keypairs):
+    """Tests that a missing key file surfaces as a ConnectionError."""
+    with pytest.raises(ConnectionError, match="/missing/key"):
+        load_client_keys(["/missing/key"])
+
+
+@pytest.mark.asyncio
+async def test_stream_command_output_separate_output():
+    """Tests that separate_output queues the whole output as one item."""
+    conn = fake_connection([b"line 1\nli", b"ne 2\xc3", b"\xa9\n", b""])
+
+    queue = OutputQueue()
+    await stream_command_output(conn, "host", "true", 80, queue, False, True)
+    assert await queue.get_all() == [("host", "line 1\nline 2\u00e9\n")]
+
+
+def test_pooled_ssh_client_removes_lost_connection():
+    """Tests that a lost connection is dropped from the connection pool."""
+    pool_key = ("10.0.0.1", 22, "user", ("/key",))
+    conn = MagicMock()
+    client = PooledSSHClient(pool_key)
+    client.connection_made(conn)
+    CONN_POOL[pool_key] = conn
+    client.connection_lost(None)
+    assert pool_key not in CONN_POOL
+
+    # A replacement connection already in the pool is left alone
+    CONN_POOL[pool_key] = MagicMock()
+    client.connection_lost(None)
+    assert pool_key in CONN_POOL
+    CONN_POOL.clear()
+
+
+@patch("ananta.ssh.get_ssh_keys", return_value=["/path/to/key"])
+def test_resolve_ssh_keys_is_cached(mock_get_ssh_keys):
+    """Tests that key resolution runs once per (key_path, default_key)."""
+    resolve_ssh_keys.cache_clear()
+    assert resolve_ssh_keys("#", None) == ("/path/to/key",)
+    assert resolve_ssh_keys("#", None) == ("/path/to/key",)
+    mock_get_ssh_keys.assert_called_once_with("#", None)
+    resolve_ssh_keys.cache_clear()
+
+
+def test_retry_delay_backs_off_exponentially():
+    """Tests that retry delays grow by 4x per attempt with a small jitter."""
+    for attempt, base in enumerate([0.1, 0.4, 1.6]):
+        delay = retry_delay(attempt)
+        assert base <= delay <= base + 0.1
+
+
+@pytest.mark.asyncio
+async def test_execute_releases_semaphore_before_streaming():
+    """Tests that only the handshake holds the semaphore, then releases."""
+    semaphore = asyncio.Semaphore(1)
+    held_while_streaming = []
+
+    async def fake_stream(*args):
+        held_while_streaming.append(semaphore.locked())
+
+    with (
+        patch(
+            "ananta.ssh.establish_ssh_connection",
+            new=AsyncMock(return_value=MagicMock()),
+        ),
+        patch("ananta.ssh.stream_command_output", new=fake_stream),
+        patch("ananta.ssh.release_ssh_connection", new=AsyncMock()) as release,
+    ):
+        await execute(
+            Host("host", "10.0.0.1", 22, "user", "#"),
+            "uptime",
+            80,
+            False,
+            None,
+            OutputQueue(),
+            False,
+            semaphore,
+        )
+    assert held_while_streaming == [False]
+    # The connection is given back once the command is done
+    release.assert_awaited_once()
+
+
+def test_get_process_options_sets_size_portably():
+    """Tests that COLUMNS/LINES are set with env, which any shell can run."""
+    options = get_process_options("uptime", 80, False)
+    assert options["command"] == f"env COLUMNS=80 LINES={LINES} uptime"
+    assert "env" not in options
+    # The cached options are shared by every host, so they are read-only
+    with pytest.raises(TypeError):
+        options["command"] = "reboot"
+    assert options["term_size"] == (80, LINES)
+
+
+@pytest.mark.asyncio
+async def test_execute_reports_connection_error_once():
+    """Tests that a refused connection is reported with a single prefix."""
+    CONN_POOL.clear()
+    queue = OutputQueue()
+    with (
+        patch("ananta.ssh.load_client_keys", return_value=[]),
+        patch(
+            "ananta.ssh.asyncssh.connect",
+            new=AsyncMock(side_effect=ConnectionRefusedError("refused")),
+        ),
+    ):
+        await execute(
+            Host("host", "10.0.0.1", 22, "user", "/key"),
+            "uptime",
+            80,
+            False,
+            None,
+            queue,
+            False,
+            asyncio.Semaphore(1),
+        )
+    assert await queue.get_all() == [
+        ("host", "Error connecting to host: refused"),
+        ("host", get_end_marker("host", 80, False)),
+    ]